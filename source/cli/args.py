@@ -5,15 +5,25 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable
 
+from profiling import PROFILERS
+
 
 @dataclass(frozen=True)
 class CliArgs:
     input_dir: Path
     start: str | None
     end: str | None
+    metrics_file: Path
+    profile_stages: tuple[str, ...]
+    profiler: str
+    profile_dir: Path
+    resume: bool
+    state_dir: Path
+    agent_retries: int
+    agent_backoff: float
 
 
-def build_parser(default_input_dir: Path) -> argparse.ArgumentParser:
+def build_parser(default_input_dir: Path, default_metrics_file: Path, default_state_dir: Path) -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Process audio files in a folder and send to LLM agent"
     )
@@ -32,10 +42,70 @@ def build_parser(default_input_dir: Path) -> argparse.ArgumentParser:
         default=None,
         help="End of period (YYYY-MM-DD or ISO datetime)",
     )
+    parser.add_argument(
+        "--metrics-file",
+        default=str(default_metrics_file),
+        help="JSON lines file receiving one metrics record per processed file",
+    )
+    parser.add_argument(
+        "--profile-stages",
+        default="",
+        help="Comma separated stages to profile (transcription,convert,diarization,diarization_server,merge,agent,db_save or all)",
+    )
+    parser.add_argument(
+        "--profiler",
+        default="cprofile",
+        choices=PROFILERS,
+        help="Profiler used for --profile-stages",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=str(default_metrics_file.parent / "profiles"),
+        help="Folder for profiler output",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue each file from its last completed stage in the state journal",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=str(default_state_dir),
+        help="Folder with per-file stage journals",
+    )
+    parser.add_argument(
+        "--agent-retries",
+        type=int,
+        default=3,
+        help="Attempts per LLM Agent call before giving up",
+    )
+    parser.add_argument(
+        "--agent-backoff",
+        type=float,
+        default=5.0,
+        help="Initial delay in seconds between LLM Agent retries, doubled each attempt",
+    )
     return parser
 
 
-def parse_cli_args(default_input_dir: Path, argv: Iterable[str] | None = None) -> CliArgs:
-    parser = build_parser(default_input_dir)
+def parse_cli_args(
+    default_input_dir: Path,
+    default_metrics_file: Path,
+    default_state_dir: Path,
+    argv: Iterable[str] | None = None,
+) -> CliArgs:
+    parser = build_parser(default_input_dir, default_metrics_file, default_state_dir)
     args = parser.parse_args(list(argv) if argv is not None else None)
-    return CliArgs(input_dir=Path(args.input_dir), start=args.start, end=args.end)
+    return CliArgs(
+        input_dir=Path(args.input_dir),
+        start=args.start,
+        end=args.end,
+        metrics_file=Path(args.metrics_file),
+        profile_stages=tuple(s.strip() for s in args.profile_stages.split(",") if s.strip()),
+        profiler=args.profiler,
+        profile_dir=Path(args.profile_dir),
+        resume=args.resume,
+        state_dir=Path(args.state_dir),
+        agent_retries=max(1, args.agent_retries),
+        agent_backoff=args.agent_backoff,
+    )
@@ -1 +1,2 @@
 from .nemo_config import load_nemo_diar_base_cfg
+from .nemo_diarizer import NemoDiarizer, make_work_dir
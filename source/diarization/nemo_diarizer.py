@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from omegaconf import OmegaConf
+
+from transcription.pick_best_speaker import DiarSegment, parse_rttm
+
+DIAR_OUT_ROOT = Path(__file__).resolve().parent.parent.parent / "output" / "diarization"
+
+
+def make_work_dir() -> str:
+    """Create a scratch dir for NeMo output, falling back to the system temp dir."""
+    try:
+        DIAR_OUT_ROOT.mkdir(parents=True, exist_ok=True)
+        if not os.access(DIAR_OUT_ROOT, os.W_OK):
+            raise PermissionError(f"Not writable: {DIAR_OUT_ROOT}")
+        tmpdir = tempfile.mkdtemp(prefix="diar_", dir=str(DIAR_OUT_ROOT))
+    except PermissionError:
+        tmpdir = tempfile.mkdtemp(prefix="diar_", dir=tempfile.gettempdir())
+        print(f"[NeMo] Using fallback temp dir: {tmpdir}")
+    print(f"[NeMo] Diarization output dir: {tmpdir}")
+    return tmpdir
+
+
+class NemoDiarizer:
+    """
+    Keeps the speaker embedding model warm across calls.
+
+    A fresh ClusteringDiarizer is built for every call from the updated cfg, with
+    the already-loaded speaker model passed in through its speaker_model argument
+    (public constructor API as of nemo_toolkit 2.6.2). The small VAD model is still
+    loaded by each diarizer from NeMo's local checkpoint cache.
+    """
+
+    def __init__(self, diar_base_cfg, diar_yaml_path: Path):
+        self.diar_base_cfg = diar_base_cfg
+        self.diar_yaml_path = diar_yaml_path
+        self._speaker_model = None
+
+    def _load_speaker_model(self):
+        import torch
+        from nemo.collections.asr.models import EncDecSpeakerLabelModel
+
+        model_path = str(self.diar_base_cfg.diarizer.speaker_embeddings.model_path)
+        device = torch.device(self.diar_base_cfg.get("device") or "cpu")
+        print(f"[NeMo] Loading speaker embedding model: {model_path}")
+        if model_path.endswith(".nemo"):
+            return EncDecSpeakerLabelModel.restore_from(restore_path=model_path, map_location=device)
+        return EncDecSpeakerLabelModel.from_pretrained(model_name=model_path, map_location=device)
+
+    def diarize_wavs(self, wav_paths: list[str], out_dir: str) -> list[list[DiarSegment]]:
+        """Diarize mono 16kHz WAVs in one NeMo pass; WAV basenames must be unique."""
+        from nemo.collections.asr.models import ClusteringDiarizer
+
+        # Create manifest for NeMo, one line per file
+        manifest_path = os.path.join(out_dir, "manifest.json")
+        with open(manifest_path, "w") as f:
+            for wav_path in wav_paths:
+                manifest_entry = {
+                    "audio_filepath": wav_path,
+                    "offset": 0.0,
+                    "duration": None,
+                    "label": "infer",
+                    "text": "-",
+                    "num_speakers": 2,
+                    "rttm_filepath": None,
+                    "uem_filepath": None,
+                }
+                json.dump(manifest_entry, f)
+                f.write("\n")
+
+        if self._speaker_model is None:
+            self._speaker_model = self._load_speaker_model()
+
+        # Configure NeMo diarizer
+        cfg = OmegaConf.create(OmegaConf.to_container(self.diar_base_cfg, resolve=False))
+        cfg.diarizer.manifest_filepath = manifest_path
+        cfg.diarizer.out_dir = out_dir
+        print(f"[NeMo] Using diarization config: {self.diar_yaml_path}")
+
+        diarizer = ClusteringDiarizer(cfg=cfg, speaker_model=self._speaker_model)
+        diarizer.diarize()
+
+        # Parse RTTM output
+        rttm_dir = Path(out_dir) / "pred_rttms"
+        if not any(rttm_dir.glob("*.rttm")):
+            rttm_dir = Path(out_dir) / "speaker_outputs" / "pred_rttms"
+
+        results = []
+        for wav_path in wav_paths:
+            rttm_path = rttm_dir / f"{Path(wav_path).stem}.rttm"
+            if rttm_path.exists():
+                results.append(parse_rttm(str(rttm_path)))
+                continue
+            print(f"Warning: NeMo did not produce RTTM output for {Path(wav_path).name}")
+            speaker_outputs = Path(out_dir) / "speaker_outputs"
+            if speaker_outputs.exists():
+                print(f"[NeMo] speaker_outputs contents: {list(speaker_outputs.iterdir())}")
+            else:
+                print("[NeMo] speaker_outputs folder not found")
+            results.append([])
+        return results
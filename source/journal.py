@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+# Completed pipeline stages, in order. "analysis" holds the parsed LLM result
+# when the DB write failed, so a retry only has to redo the save.
+STAGES = ("transcription", "diarization", "dialog", "analysis", "submission")
+
+DEFAULT_STATE_DIR = Path(__file__).resolve().parent.parent / "output" / "state"
+
+
+def atomic_write_json(path: Path, data: Any) -> None:
+    """Write JSON to a temp file in the same dir, fsync it and rename it over path."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _source_fingerprint(file_path: Path) -> dict:
+    stat = file_path.stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+@dataclass
+class FileJournal:
+    """Per-file stage journal so a rerun can continue from the last completed stage."""
+    path: Path
+    file: str
+    source: dict
+    stages: dict[str, dict] = field(default_factory=dict)
+
+    @classmethod
+    def for_file(cls, state_dir: Path, file_path: Path, resume: bool) -> FileJournal:
+        """Load the journal for file_path when resuming, otherwise start a fresh one."""
+        journal = cls(path=state_dir / f"{file_path.name}.json", file=file_path.name, source=_source_fingerprint(file_path))
+        if not resume or not journal.path.exists():
+            return journal
+
+        try:
+            with open(journal.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[journal] Ignoring unreadable journal {journal.path}: {e}")
+            return journal
+
+        if data.get("source") != journal.source:
+            print(f"[journal] {file_path.name} changed since the last run, starting over")
+            return journal
+
+        journal.stages = {name: entry for name, entry in data.get("stages", {}).items() if name in STAGES}
+        return journal
+
+    def done(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def get(self, stage: str) -> Any:
+        return self.stages[stage]["data"]
+
+    def last_completed(self) -> str | None:
+        completed = [s for s in STAGES if s in self.stages]
+        return completed[-1] if completed else None
+
+    def complete(self, stage: str, data: Any) -> None:
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        self.stages[stage] = {"completed_at": datetime.now(timezone.utc).isoformat(), "data": data}
+        self.save()
+
+    def save(self) -> None:
+        atomic_write_json(self.path, {"file": self.file, "source": self.source, "stages": self.stages})
@@ -4,9 +4,14 @@ Runs on localhost:5001 (locally) or 0.0.0.0:5001 (Docker)
 """
 import os
 import json
+import time
 import requests
 import psycopg
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+
+from agent_metrics import CONTENT_TYPE, REGISTRY
+from ollama_dispatcher import DispatchRejected, OllamaDispatcher
+from profiling import StageProfiler
 
 app = Flask(__name__)
 
@@ -43,8 +48,33 @@ SYSTEM_PROMPT = """Ты - профессиональный анализатор
 """
 
 OLLAMA_API = os.getenv("OLLAMA_API", "http://127.0.0.1:11434/api/generate")
+# Comma separated list of Ollama generate endpoints; falls back to the single OLLAMA_API
+OLLAMA_APIS = [url.strip() for url in os.getenv("OLLAMA_APIS", OLLAMA_API).split(",") if url.strip()]
 MODEL_NAME = os.getenv("MODEL_NAME", "gemma3")
 
+DISPATCHER = OllamaDispatcher(
+    OLLAMA_APIS,
+    max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")),
+    max_queue=int(os.getenv("DISPATCH_MAX_QUEUE", "32")),
+    queue_timeout=float(os.getenv("DISPATCH_QUEUE_TIMEOUT", "300")),
+    probe_interval=float(os.getenv("OLLAMA_PROBE_INTERVAL", "15")),
+    eject_after=int(os.getenv("OLLAMA_EJECT_AFTER", "3")),
+    eject_seconds=float(os.getenv("OLLAMA_EJECT_SECONDS", "30")),
+)
+
+# Optional per-stage profiling: PROFILE_STAGES=ollama,db PROFILER=cprofile|py-spy PROFILE_DIR=...
+PROFILER = StageProfiler.from_env()
+
+ANALYZE_LATENCY = REGISTRY.histogram("agent_analyze_seconds", "End-to-end /analyze latency")
+DB_LATENCY = REGISTRY.histogram(
+    "agent_db_save_seconds", "Database save latency", buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+IN_FLIGHT = REGISTRY.gauge("agent_analyze_in_flight", "Analyze requests currently being processed")
+REQUESTS = REGISTRY.counter("agent_analyze_requests_total", "Analyze requests by HTTP status", ("code",))
+ERRORS = REGISTRY.counter("agent_errors_total", "Errors by kind", ("kind",))
+PROMPT_TOKENS = REGISTRY.counter("agent_prompt_tokens_total", "Prompt tokens evaluated by Ollama")
+RESPONSE_TOKENS = REGISTRY.counter("agent_response_tokens_total", "Response tokens generated by Ollama")
+
 
 def get_db_connection():
     """Create and return database connection"""
@@ -120,13 +150,31 @@ def parse_llm_response(analysis: str) -> tuple[dict | None, str | None]:
 @app.route("/analyze", methods=["POST"])
 def analyze():
     """Analyze dialog and return assessment"""
-    data = request.json
+    IN_FLIGHT.inc()
+    try:
+        with ANALYZE_LATENCY.time():
+            body, status_code = run_analysis(request.json or {})
+    finally:
+        IN_FLIGHT.dec()
+    REQUESTS.inc(code=status_code)
+    response = jsonify(body)
+    if "retry_after" in body:
+        response.headers["Retry-After"] = str(body["retry_after"])
+    return response, status_code
+
+
+def run_analysis(data: dict) -> tuple[dict, int]:
+    """
+    Run the LLM analysis and DB save for one dialog
+    Returns (response_body, http_status)
+    """
     dialog_text = data.get("dialog", "")
     recorded_at = data.get("record_time", "")
     full_name = data.get("full_name", "")
     
     if not dialog_text:
-        return jsonify({"error": "No dialog provided"}), 400
+        ERRORS.inc(kind="bad_request")
+        return {"error": "No dialog provided"}, 400
     
     full_prompt = f"{SYSTEM_PROMPT}\n\nДиалог:\n{dialog_text}"
     
@@ -136,55 +184,131 @@ def analyze():
         "stream": False
     }
     
-    print(f"[analyze] Sending request to Ollama at {OLLAMA_API}")
+    print(f"[analyze] Sending request to Ollama ({len(OLLAMA_APIS)} backend(s))")
     
+    metrics = {}
     try:
         print(f"[analyze] Calling Ollama with timeout=600...")
-        response = requests.post(OLLAMA_API, json=payload, timeout=600)
+        started = time.perf_counter()
+        with PROFILER.profile("ollama"):
+            response = DISPATCHER.post(payload, timeout=600)
+        # Dispatcher queue wait plus the Ollama call(s); per-call latency is in agent_ollama_request_seconds
+        metrics["dispatch_s"] = round(time.perf_counter() - started, 3)
         print(f"[analyze] Got response with status {response.status_code}")
         if response.status_code == 200:
             result = response.json()
             analysis = result.get("response", "").strip()
             print(f"[analyze] Success, response length: {len(analysis)}")
+            metrics.update(ollama_usage(result))
+            PROMPT_TOKENS.inc(metrics.get("prompt_tokens") or 0)
+            RESPONSE_TOKENS.inc(metrics.get("response_tokens") or 0)
 
             # Parse LLM response
             analysis_data, parse_error = parse_llm_response(analysis)
             
             if parse_error:
                 print(f"[analyze] Parse error: {parse_error}")
-                return jsonify({
+                ERRORS.inc(kind="parse")
+                return {
                     "error": parse_error,
                     "raw_response": analysis,
-                    "status": "error"
-                }), 400
+                    "status": "error",
+                    "metrics": metrics
+                }, 400
             
             # Save to database if full_name provided
             db_saved = False
             db_error = None
             
             if full_name:
-                db_saved, db_error = save_to_database(full_name, recorded_at, analysis_data)
+                started = time.perf_counter()
+                with PROFILER.profile("db"):
+                    db_saved, db_error = save_to_database(full_name, recorded_at, analysis_data)
+                metrics["db_s"] = round(time.perf_counter() - started, 3)
+                DB_LATENCY.observe(metrics["db_s"])
                 print(f"[analyze] Database save: {'success' if db_saved else 'failed'}")
                 if db_error:
                     print(f"[analyze] DB error: {db_error}")
+                    ERRORS.inc(kind="db")
             else:
                 print("[analyze] No full_name provided, skipping database save")
                 db_error = "No full_name provided"
 
-            return jsonify({
+            return {
                 "analysis": analysis,
                 "parsed_data": analysis_data,
                 "db_saved": db_saved,
                 "db_error": db_error,
-                "status": "success" if db_saved else "partial"
-            })
+                "status": "success" if db_saved else "partial",
+                "metrics": metrics
+            }, 200
         else:
             print(f"[analyze] Ollama error: {response.status_code}")
-            return jsonify({"error": f"Ollama error: {response.status_code}", "status": "error"}), 500
+            ERRORS.inc(kind="ollama_status")
+            return {"error": f"Ollama error: {response.status_code}", "status": "error", "metrics": metrics}, 500
+    except DispatchRejected as e:
+        print(f"[analyze] Rejected: {e}")
+        ERRORS.inc(kind="rejected")
+        return {"error": str(e), "status": "error", "retry_after": e.retry_after}, e.status_code
     except requests.exceptions.ConnectionError:
-        return jsonify({"error": f"Cannot connect to Ollama on {OLLAMA_API}", "status": "error"}), 500
+        ERRORS.inc(kind="ollama_connection")
+        return {"error": f"Cannot connect to Ollama on {', '.join(OLLAMA_APIS)}", "status": "error"}, 500
+    except requests.exceptions.Timeout as e:
+        ERRORS.inc(kind="ollama_timeout")
+        return {"error": str(e), "status": "error"}, 504
     except Exception as e:
-        return jsonify({"error": str(e), "status": "error"}), 500
+        ERRORS.inc(kind="internal")
+        return {"error": str(e), "status": "error"}, 500
+
+
+@app.route("/save", methods=["POST"])
+def save():
+    """Save an already parsed analysis, used to retry a failed database write without the LLM"""
+    data = request.json or {}
+    full_name = data.get("full_name", "")
+    recorded_at = data.get("record_time", "")
+    analysis_data = data.get("parsed_data")
+
+    if not full_name or not isinstance(analysis_data, dict):
+        ERRORS.inc(kind="bad_request")
+        return jsonify({"error": "full_name and parsed_data are required", "status": "error"}), 400
+
+    started = time.perf_counter()
+    with PROFILER.profile("db"):
+        db_saved, db_error = save_to_database(full_name, recorded_at, analysis_data)
+    db_s = round(time.perf_counter() - started, 3)
+    DB_LATENCY.observe(db_s)
+    print(f"[save] Database save: {'success' if db_saved else 'failed'}")
+
+    if db_saved:
+        return jsonify({"db_saved": True, "db_error": None, "status": "success", "metrics": {"db_s": db_s}})
+
+    print(f"[save] DB error: {db_error}")
+    ERRORS.inc(kind="db")
+    # Unknown employee will not fix itself; anything else is worth retrying
+    status_code = 404 if db_error.startswith("Employee not found") else 503
+    return jsonify({"db_saved": False, "db_error": db_error, "status": "error", "metrics": {"db_s": db_s}}), status_code
+
+
+def ollama_usage(result: dict) -> dict:
+    """Extract token counts and timings from an Ollama /api/generate response"""
+    usage = {
+        "prompt_tokens": result.get("prompt_eval_count"),
+        "response_tokens": result.get("eval_count"),
+    }
+    # Ollama reports durations in nanoseconds
+    for key in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration"):
+        if result.get(key) is not None:
+            usage[f"{key.removesuffix('_duration')}_s"] = round(result[key] / 1e9, 3)
+    if usage["response_tokens"] and result.get("eval_duration"):
+        usage["tokens_per_s"] = round(usage["response_tokens"] / (result["eval_duration"] / 1e9), 2)
+    return usage
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
 
 
 @app.route("/health", methods=["GET"])
@@ -202,11 +326,13 @@ if __name__ == "__main__":
     print(f"LLM Agent Server starting on http://{HOST}:{PORT}")
     print(f"Running in: {'Docker' if IN_DOCKER else 'Local'}")
     print(f"Using model: {MODEL_NAME}")
-    print(f"Ollama API: {OLLAMA_API}")
+    print(f"Ollama API: {', '.join(OLLAMA_APIS)}")
     print(f"System prompt loaded.\n")
     print("Endpoints:")
     print(f"  POST /analyze - Send dialog_text, get analysis")
-    print(f"  GET /health - Health check\n")
+    print(f"  POST /save - Save an already parsed analysis")
+    print(f"  GET /health - Health check")
+    print(f"  GET /metrics - Prometheus metrics\n")
     try:
         app.run(host=HOST, port=PORT, debug=False, threaded=True)
     except OSError as e:
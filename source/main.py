@@ -5,14 +5,16 @@ import sys
 import warnings
 from pathlib import Path
 
-import torch
-import whisper
 import requests
 from dotenv import load_dotenv
 
 from pipeline import analyze_file
 from cli.args import parse_cli_args
-from diarization.nemo_config import load_nemo_diar_base_cfg
+from journal import DEFAULT_STATE_DIR, FileJournal
+from profiling import StageProfiler
+from retry import RetryPolicy
+from speech_models import InProcessModels, ModelServerClient
+from telemetry import FileRecord, append_record
 from utils import parse_user_datetime, parse_filename, should_process
 
 load_dotenv()
@@ -26,15 +28,19 @@ DEFAULT_INPUT_DIR = (
     else Path(__file__).resolve().parent.parent / "audios"
 )
 
+DEFAULT_METRICS_FILE = Path(__file__).resolve().parent.parent / "output" / "metrics" / "pipeline.jsonl"
+
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
-AGENT_API = os.getenv("LLM_AGENT_HOST", "http://localhost:5001") + "/analyze"
+AGENT_HOST = os.getenv("LLM_AGENT_HOST", "http://localhost:5001")
+# Shared warm Whisper/NeMo service (model_server.py); set to empty to always load models in-process
+MODEL_SERVER_HOST = os.getenv("MODEL_SERVER_HOST", "http://localhost:5002")
 
 
 warnings.filterwarnings("ignore")
 
 
 def main():
-    args = parse_cli_args(DEFAULT_INPUT_DIR)
+    args = parse_cli_args(DEFAULT_INPUT_DIR, DEFAULT_METRICS_FILE, DEFAULT_STATE_DIR)
     input_dir = args.input_dir
     if not input_dir.exists() or not input_dir.is_dir():
         print(f"Error: input directory not found: {input_dir}")
@@ -48,16 +54,20 @@ def main():
         print(f"No .mp3 files found in {input_dir}")
         sys.exit(1)
 
-    print("Loading Whisper model...")
-    whisper_model = whisper.load_model(WHISPER_MODEL)
+    models = InProcessModels(WHISPER_MODEL)
+    client = ModelServerClient(MODEL_SERVER_HOST, fallback=models) if MODEL_SERVER_HOST else None
+    if client and client.available():
+        print(f"Using model server at {MODEL_SERVER_HOST}")
+        models = client
+    else:
+        models.load()
 
-    print("Loading NeMo diarization config...")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using {device.upper()} for NeMo.")
-    diar_base_cfg, diar_yaml_path = load_nemo_diar_base_cfg(device=device, max_num_speakers=3, min_num_speakers=2)
+    profiler = StageProfiler(args.profile_stages, args.profile_dir, args.profiler) if args.profile_stages else None
+    retry = RetryPolicy(attempts=args.agent_retries, backoff=args.agent_backoff)
 
     had_errors = False
     processed = 0
+    pending_saves = 0
 
     for file_path in files:
         parsed = parse_filename(file_path)
@@ -70,30 +80,44 @@ def main():
             continue
 
         processed += 1
+        record = FileRecord(file=file_path.name, profiler=profiler)
         try:
+            journal = FileJournal.for_file(args.state_dir, file_path, resume=args.resume)
             ok = analyze_file(
                 file_path,
-                whisper_model,
+                models,
                 full_name,
                 record_time,
-                AGENT_API,
-                diar_base_cfg,
-                diar_yaml_path,
+                AGENT_HOST,
+                record=record,
+                journal=journal,
+                retry=retry,
             )
+            if record.status == "pending":
+                record.status = "ok" if ok else "failed"
             if not ok:
                 had_errors = True
-        except requests.exceptions.ConnectionError:
-            print(f"Error: Cannot connect to LLM Agent at {AGENT_API}")
+            if record.status == "pending_save":
+                pending_saves += 1
+        except requests.exceptions.ConnectionError as e:
+            print(f"Error: Cannot connect to LLM Agent at {AGENT_HOST}")
             print("Make sure the LLM Agent service is running.")
+            record.status, record.error = "error", str(e)
             had_errors = True
         except Exception as e:
             print(f"Failed to process {file_path.name}: {e}")
+            record.status, record.error = "error", str(e)
             had_errors = True
+        finally:
+            append_record(args.metrics_file, record)
 
     if processed == 0:
         print("No files matched the specified period.")
         sys.exit(1)
 
+    if pending_saves:
+        print(f"\n{pending_saves} file(s) analyzed but not saved to the database; rerun with --resume.")
+
     if had_errors:
         print("\nCompleted with errors.")
         sys.exit(1)
@@ -0,0 +1,197 @@
+"""
+Model Server - keeps Whisper and NeMo diarization models warm for local pipeline runs
+Runs on localhost:5002; main.py uses it when reachable (MODEL_SERVER_HOST)
+"""
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import Future
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+from flask import Flask, request, jsonify
+
+from diarization import make_work_dir
+from prepare_audio import convert_to_mono_wav, wav_duration
+from speech_models import InProcessModels, whisper_segments
+
+load_dotenv()
+warnings.filterwarnings("ignore")
+
+app = Flask(__name__)
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+MAX_BATCH = int(os.getenv("MODEL_SERVER_MAX_BATCH", "8"))
+# How long the diarization worker waits for more requests to join a batch
+BATCH_WINDOW = float(os.getenv("MODEL_SERVER_BATCH_WINDOW", "0.5"))
+
+MODELS = InProcessModels(WHISPER_MODEL)
+
+
+class BatchWorker:
+    """
+    Single worker thread that collects concurrent requests into batches
+    handler(items) must return one result (or Exception) per item
+    """
+
+    def __init__(self, name: str, handler: Callable[[list], list], max_batch: int, window: float):
+        self.name = name
+        self.handler = handler
+        self.max_batch = max_batch
+        self.window = window
+        self._queue: queue.Queue[tuple[Any, Future]] = queue.Queue()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, item) -> Any:
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            print(f"[{self.name}] Processing batch of {len(batch)}")
+            try:
+                results = self.handler([item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def transcribe_batch(paths: list[str]) -> list:
+    results = []
+    for path in paths:
+        started = time.perf_counter()
+        try:
+            segments = whisper_segments(MODELS.whisper_model.transcribe(path))
+            results.append({"segments": segments, "wall_s": round(time.perf_counter() - started, 3)})
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def diarize_batch(paths: list[str]) -> list:
+    # All files go through one NeMo pass with a multi-line manifest
+    diarizer = MODELS.diarizer
+    tmpdir = make_work_dir()
+    try:
+        wavs: dict[int, str] = {}
+        results: list = [None] * len(paths)
+        for i, path in enumerate(paths):
+            try:
+                # Prefix keeps NeMo ids unique when two clients send files with the same name
+                wavs[i] = convert_to_mono_wav(path, tmpdir, name=f"{i}_{Path(path).stem}")
+            except Exception as e:
+                results[i] = e
+
+        if wavs:
+            started = time.perf_counter()
+            segments = diarizer.diarize_wavs(list(wavs.values()), tmpdir)
+            wall_s = round(time.perf_counter() - started, 3)
+            for (i, wav_path), wav_segments in zip(wavs.items(), segments):
+                results[i] = {
+                    "segments": [asdict(s) for s in wav_segments],
+                    "audio_duration_s": round(wav_duration(wav_path), 3),
+                    "wall_s": wall_s,
+                    "batch_size": len(wavs),
+                }
+        return results
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# Whisper decodes one file at a time, so its worker only serializes access to the model
+TRANSCRIBE_WORKER = BatchWorker("whisper", transcribe_batch, max_batch=1, window=0)
+DIARIZE_WORKER = BatchWorker("nemo", diarize_batch, MAX_BATCH, BATCH_WINDOW)
+
+
+def run_on_request_audio(worker: BatchWorker):
+    """Accept {"path": ...} JSON or a multipart "audio" upload and run it through worker"""
+    upload = request.files.get("audio")
+    upload_dir = None
+    try:
+        if upload is not None:
+            upload_dir = tempfile.mkdtemp(prefix="upload_")
+            path = os.path.join(upload_dir, Path(upload.filename or "audio").name)
+            upload.save(path)
+        else:
+            path = (request.get_json(silent=True) or {}).get("path", "")
+            if not path:
+                return jsonify({"error": "Provide a file path or an audio upload"}), 400
+            if not os.path.isfile(path):
+                return jsonify({"error": f"File not found: {path}"}), 404
+
+        return jsonify(worker.submit(path))
+    except Exception as e:
+        print(f"[{worker.name}] Error: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+@app.route("/transcribe", methods=["POST"])
+def transcribe():
+    """Transcribe audio with Whisper"""
+    return run_on_request_audio(TRANSCRIBE_WORKER)
+
+
+@app.route("/diarize", methods=["POST"])
+def diarize():
+    """Diarize audio with NeMo"""
+    return run_on_request_audio(DIARIZE_WORKER)
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Health check"""
+    return jsonify({
+        "status": "ok",
+        "whisper_model": WHISPER_MODEL,
+        "queue": {"transcribe": TRANSCRIBE_WORKER.depth, "diarize": DIARIZE_WORKER.depth},
+    })
+
+
+if __name__ == "__main__":
+    PORT = int(os.getenv("MODEL_SERVER_PORT", "5002"))
+    HOST = os.getenv("MODEL_SERVER_BIND", "127.0.0.1")
+
+    print("Loading models...")
+    MODELS.load()
+
+    print(f"Model Server starting on http://{HOST}:{PORT}")
+    print("Endpoints:")
+    print(f"  POST /transcribe - Whisper segments for a file path or upload")
+    print(f"  POST /diarize - NeMo speaker segments for a file path or upload")
+    print(f"  GET /health - Health check\n")
+    try:
+        app.run(host=HOST, port=PORT, debug=False, threaded=True)
+    except OSError as e:
+        print(f"Error: {e}")
+        print(f"Port {PORT} might be already in use. Try: lsof -i :{PORT}")
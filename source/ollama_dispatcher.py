@@ -0,0 +1,309 @@
+"""
+Load-balanced dispatcher across several Ollama backends
+Least-outstanding-requests balancing with per-backend concurrency limits,
+health probing/ejection, fail-over and a bounded admission queue
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import deque
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from agent_metrics import REGISTRY
+
+QUEUE_DEPTH = REGISTRY.gauge("agent_dispatch_queue_depth", "Requests waiting for a free Ollama backend slot")
+BACKEND_OUTSTANDING = REGISTRY.gauge("agent_backend_outstanding", "Requests in flight per Ollama backend", ("backend",))
+BACKEND_HEALTHY = REGISTRY.gauge("agent_backend_healthy", "1 if the Ollama backend is in rotation", ("backend",))
+REJECTED = REGISTRY.counter("agent_dispatch_rejected_total", "Requests rejected by admission control", ("reason",))
+FAILOVERS = REGISTRY.counter("agent_dispatch_failovers_total", "Requests retried on another backend", ("backend",))
+QUEUE_WAIT = REGISTRY.histogram("agent_dispatch_queue_wait_seconds", "Time spent waiting for an Ollama backend slot")
+OLLAMA_LATENCY = REGISTRY.histogram(
+    "agent_ollama_request_seconds", "Ollama generate request latency per backend, excluding queue wait", ("backend",)
+)
+
+
+class DispatchRejected(Exception):
+    """Raised when a request cannot be admitted; retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: int, status_code: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class QueueFull(DispatchRejected):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, retry_after, 429)
+
+
+class NoBackendAvailable(DispatchRejected):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, retry_after, 503)
+
+
+class Backend:
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url
+        parts = urlsplit(url)
+        self.base_url = f"{parts.scheme}://{parts.netloc}"
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        # Only ejections caused by a failed health probe are lifted by a passing probe
+        self.ejected_by_probe = False
+
+    def in_rotation(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def has_slot(self) -> bool:
+        return self.outstanding < self.max_concurrency
+
+
+class _Waiter:
+    """A request queued for a backend slot"""
+    __slots__ = ("exclude", "failover")
+
+    def __init__(self, exclude: set[str], failover: bool):
+        self.exclude = exclude
+        self.failover = failover
+
+
+class OllamaDispatcher:
+    """
+    Thread-safe dispatcher for Ollama /api/generate calls
+
+    Each request takes a slot on the in-rotation backend with the fewest
+    outstanding requests. When every slot is busy the caller waits in a
+    bounded FIFO queue; past max_queue or queue_timeout it gets QueueFull (429).
+    A freed slot goes to the first waiter that can use that backend.
+    Backends failing eject_after requests in a row are ejected for
+    eject_seconds. Backends failing a health probe are ejected until a
+    probe passes again.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        max_concurrency: int = 2,
+        max_queue: int = 32,
+        queue_timeout: float = 300.0,
+        probe_interval: float = 15.0,
+        eject_after: int = 3,
+        eject_seconds: float = 30.0,
+    ):
+        if not urls:
+            raise ValueError("At least one Ollama backend URL is required")
+        self.backends = [Backend(url, max_concurrency) for url in urls]
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.probe_interval = probe_interval
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+
+        self._cond = threading.Condition()
+        # Waiters in service order: failover retries first, then arrival order
+        self._waiters: deque[_Waiter] = deque()
+        self._avg_latency = 30.0
+        self._prober: threading.Thread | None = None
+
+        for backend in self.backends:
+            BACKEND_OUTSTANDING.set(0, backend=backend.url)
+            BACKEND_HEALTHY.set(1, backend=backend.url)
+
+    @property
+    def capacity(self) -> int:
+        return sum(b.max_concurrency for b in self.backends)
+
+    def post(self, payload: dict, timeout: float = 600) -> requests.Response:
+        """
+        POST payload to a backend, failing over to the others on connection errors or 5xx.
+        A read timeout is raised as is: the backend may still be generating, so
+        re-sending the prompt elsewhere would only add load.
+        """
+        self._ensure_probing()
+        tried: set[str] = set()
+        last_response = None
+        last_error: Exception | None = None
+
+        while len(tried) < len(self.backends):
+            try:
+                backend = self._acquire(exclude=tried, failover=bool(tried))
+            except DispatchRejected as e:
+                if last_error is None and last_response is None:
+                    if isinstance(e, NoBackendAvailable):
+                        REJECTED.inc(reason="no_backend")
+                    raise
+                # Report the real backend failure rather than the rejected failover
+                break
+
+            ok = False
+            started = time.perf_counter()
+            try:
+                with OLLAMA_LATENCY.time(backend=backend.url):
+                    response = requests.post(backend.url, json=payload, timeout=timeout)
+                ok = response.status_code < 500
+                if ok:
+                    return response
+                last_response = response
+                print(f"[dispatch] {backend.url} returned {response.status_code}")
+            except requests.exceptions.ConnectionError as e:
+                # Includes ConnectTimeout: the request never reached the backend
+                last_error = e
+                print(f"[dispatch] {backend.url} failed: {e}")
+            finally:
+                self._release(backend, ok, time.perf_counter() - started)
+
+            tried.add(backend.url)
+            if len(tried) < len(self.backends):
+                FAILOVERS.inc(backend=backend.url)
+
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _acquire(self, exclude: set[str], failover: bool = False) -> Backend:
+        """
+        Take a backend slot. Failover retries queue ahead of regular waiters, are
+        exempt from max_queue and get a slot as soon as one they can use is free.
+        """
+        with self._cond:
+            started = time.monotonic()
+            waiter = _Waiter(exclude, failover)
+            backend = self._pick(exclude)
+            if backend is None or self._earlier_waiter_servable(waiter):
+                if not failover and self.waiting >= self.max_queue:
+                    REJECTED.inc(reason="queue_full")
+                    raise QueueFull(f"Dispatch queue is full ({self.waiting} waiting)", self._retry_after())
+                backend = self._wait_for_slot(waiter)
+
+            QUEUE_WAIT.observe(time.monotonic() - started)
+            backend.outstanding += 1
+            BACKEND_OUTSTANDING.set(backend.outstanding, backend=backend.url)
+            return backend
+
+    def _wait_for_slot(self, waiter: _Waiter) -> Backend:
+        """Block (holding the condition) until no earlier waiter can use a free slot this one can"""
+        if waiter.failover:
+            # Behind earlier failovers, ahead of everyone else
+            position = sum(1 for w in self._waiters if w.failover)
+            self._waiters.insert(position, waiter)
+        else:
+            self._waiters.append(waiter)
+        QUEUE_DEPTH.set(self.waiting)
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while True:
+                backend = self._pick(waiter.exclude)
+                if backend is not None and not self._earlier_waiter_servable(waiter):
+                    return backend
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    REJECTED.inc(reason="queue_timeout")
+                    raise QueueFull(f"No Ollama slot freed within {self.queue_timeout:.0f}s", self._retry_after())
+                # Wake up periodically as well, ejections expire without a notification
+                self._cond.wait(min(remaining, 1.0))
+        finally:
+            self._waiters.remove(waiter)
+            QUEUE_DEPTH.set(self.waiting)
+            # Let the other waiters check for a slot
+            self._cond.notify_all()
+
+    def _earlier_waiter_servable(self, waiter: _Waiter) -> bool:
+        """
+        True if a waiter ahead of this one could take a free slot right now. A new
+        arrival counts as last in line, or first among regular waiters for a failover.
+        Waiters whose exclude set rules out every free backend are skipped, so a
+        failed-over request waiting for one busy backend does not stall the rest.
+        """
+        for earlier in self._waiters:
+            if earlier is waiter or (waiter.failover and not earlier.failover):
+                return False
+            try:
+                if self._pick(earlier.exclude) is not None:
+                    return True
+            except NoBackendAvailable:
+                continue
+        return False
+
+    def _pick(self, exclude: set[str]) -> Backend | None:
+        """Least-outstanding in-rotation backend with a free slot; raises if none is in rotation"""
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.url not in exclude and b.in_rotation(now)]
+        if not candidates:
+            # Probe ejections have no end time; the next probe is the earliest they can return
+            expiries = [b.ejected_until - now for b in self.backends if b.ejected_until != float("inf")]
+            retry_after = min(expiries, default=self.probe_interval)
+            raise NoBackendAvailable("No healthy Ollama backend available", max(1, math.ceil(retry_after)))
+        free = [b for b in candidates if b.has_slot()]
+        if not free:
+            return None
+        return min(free, key=lambda b: (b.outstanding / b.max_concurrency, b.outstanding))
+
+    def _release(self, backend: Backend, ok: bool, elapsed: float) -> None:
+        with self._cond:
+            backend.outstanding -= 1
+            BACKEND_OUTSTANDING.set(backend.outstanding, backend=backend.url)
+            if ok:
+                backend.consecutive_failures = 0
+                self._avg_latency = 0.8 * self._avg_latency + 0.2 * elapsed
+            else:
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_after:
+                    self._eject(backend)
+            self._cond.notify_all()
+
+    def _eject(self, backend: Backend, by_probe: bool = False) -> None:
+        backend.ejected_until = float("inf") if by_probe else time.monotonic() + self.eject_seconds
+        backend.ejected_by_probe = by_probe
+        BACKEND_HEALTHY.set(0, backend=backend.url)
+        if by_probe:
+            print(f"[dispatch] Ejected {backend.url} until its health probe passes")
+        else:
+            print(f"[dispatch] Ejected {backend.url} for {self.eject_seconds:.0f}s")
+
+    def _retry_after(self) -> int:
+        """Rough wait estimate: queued work divided by total capacity times mean latency"""
+        return max(1, math.ceil(self._avg_latency * (self.waiting + 1) / max(1, self.capacity)))
+
+    def _ensure_probing(self) -> None:
+        with self._cond:
+            if self._prober is not None or self.probe_interval <= 0:
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name="ollama-health", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self) -> None:
+        while True:
+            for backend in self.backends:
+                healthy = probe(backend.base_url)
+                with self._cond:
+                    now = time.monotonic()
+                    if healthy and backend.ejected_by_probe:
+                        print(f"[dispatch] {backend.url} is healthy again")
+                        backend.ejected_until = 0.0
+                        backend.ejected_by_probe = False
+                        backend.consecutive_failures = 0
+                        self._cond.notify_all()
+                    elif not healthy and backend.in_rotation(now):
+                        self._eject(backend, by_probe=True)
+                    # Request-caused ejections expire on their own after eject_seconds;
+                    # consecutive_failures is kept, so one more failure ejects again
+                    BACKEND_HEALTHY.set(1 if backend.in_rotation(now) else 0, backend=backend.url)
+            time.sleep(self.probe_interval)
+
+
+def probe(base_url: str, timeout: float = 5) -> bool:
+    """Check that an Ollama server answers on /api/version"""
+    try:
+        return requests.get(f"{base_url}/api/version", timeout=timeout).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
@@ -1,111 +1,85 @@
 from __future__ import annotations
 
-import os
-import shutil
-import tempfile
+from dataclasses import asdict
 from pathlib import Path
 
-import requests
-from nemo.collections.asr.models import ClusteringDiarizer
-from omegaconf import OmegaConf
-
-from prepare_audio import convert_to_mono_wav
-from transcription.pick_best_speaker import pick_best_speaker, parse_rttm
-from diarization.nemo_config import load_nemo_diar_base_cfg
+from journal import DEFAULT_STATE_DIR, FileJournal
+from retry import RetryPolicy, post_with_retry
+from telemetry import FileRecord
+from transcription.pick_best_speaker import DiarSegment, pick_best_speaker
 
 
 def analyze_file(
     file_path: Path,
-    whisper_model,
+    models,
     full_name: str,
     record_time: str,
-    agent_api: str,
-    diar_base_cfg,
-    diar_yaml_path: Path,
+    agent_host: str,
+    record: FileRecord | None = None,
+    journal: FileJournal | None = None,
+    retry: RetryPolicy | None = None,
 ) -> bool:
+    """
+    Run one file through the pipeline. models is an InProcessModels or a
+    ModelServerClient (see speech_models). Stages already in the journal
+    are not run again.
+    """
+    if record is None:
+        record = FileRecord(file=file_path.name)
+    if journal is None:
+        journal = FileJournal.for_file(DEFAULT_STATE_DIR, file_path, resume=False)
+    if retry is None:
+        retry = RetryPolicy()
+
     print(f"\nProcessing audio file: {file_path}\n")
+    if journal.last_completed():
+        print(f"Resuming after stage: {journal.last_completed()}\n")
+
+    if journal.done("submission"):
+        print("Already submitted, skipping.")
+        record.status = "skipped"
+        return True
 
     print("Step 1/4: Transcribing audio with Whisper...")
-    transcript = whisper_model.transcribe(str(file_path))["segments"]
-    print("Transcription complete.\n")
+    if journal.done("transcription"):
+        transcript = journal.get("transcription")
+        print("Transcription loaded from journal.\n")
+    else:
+        with record.stage("transcription") as info:
+            transcript = models.transcribe(file_path)
+            info["segments"] = len(transcript)
+        journal.complete("transcription", transcript)
+        print("Transcription complete.\n")
 
     print("Step 2/4: Running speaker diarization with NeMo...")
-
-    diar_out_root = Path(__file__).resolve().parent.parent / "output" / "diarization"
-    try:
-        diar_out_root.mkdir(parents=True, exist_ok=True)
-        if not os.access(diar_out_root, os.W_OK):
-            raise PermissionError(f"Not writable: {diar_out_root}")
-        tmpdir = tempfile.mkdtemp(prefix="diar_", dir=str(diar_out_root))
-    except PermissionError:
-        tmpdir = tempfile.mkdtemp(prefix="diar_", dir=tempfile.gettempdir())
-        print(f"[NeMo] Using fallback temp dir: {tmpdir}")
-    print(f"[NeMo] Diarization output dir: {tmpdir}")
-
-    try:
-        wav_path = convert_to_mono_wav(str(file_path), tmpdir)
-
-        # Create manifest for NeMo
-        manifest_path = os.path.join(tmpdir, "manifest.json")
-        import json
-
-        manifest_entry = {
-            "audio_filepath": wav_path,
-            "offset": 0.0,
-            "duration": None,
-            "label": "infer",
-            "text": "-",
-            "num_speakers": 2,
-            "rttm_filepath": None,
-            "uem_filepath": None,
-        }
-        with open(manifest_path, "w") as f:
-            json.dump(manifest_entry, f)
-            f.write("\n")
-
-        # Configure NeMo diarizer
-        cfg = OmegaConf.create(OmegaConf.to_container(diar_base_cfg, resolve=False))
-        cfg.diarizer.manifest_filepath = manifest_path
-        cfg.diarizer.out_dir = tmpdir
-        print(f"[NeMo] Using diarization config: {diar_yaml_path}")
-
-        diarizer = ClusteringDiarizer(cfg=cfg)
-        diarizer.diarize()
-
-        # Parse RTTM output
-        rttm_dir = os.path.join(tmpdir, "pred_rttms")
-        rttm_files = list(Path(rttm_dir).glob("*.rttm"))
-        if not rttm_files:
-            legacy_rttm_dir = os.path.join(tmpdir, "speaker_outputs", "pred_rttms")
-            rttm_files = list(Path(legacy_rttm_dir).glob("*.rttm"))
-            if rttm_files:
-                rttm_dir = legacy_rttm_dir
-        if not rttm_files:
-            print("Warning: NeMo did not produce RTTM output")
-            speaker_outputs = Path(tmpdir) / "speaker_outputs"
-            if speaker_outputs.exists():
-                print(f"[NeMo] speaker_outputs contents: {list(speaker_outputs.iterdir())}")
-            else:
-                print("[NeMo] speaker_outputs folder not found")
-            diarization_segments = []
-        else:
-            diarization_segments = parse_rttm(str(rttm_files[0]))
-    finally:
-        if tmpdir and Path(tmpdir).exists():
-            shutil.rmtree(tmpdir, ignore_errors=True)
-
-    print("Diarization complete.\n")
+    if journal.done("diarization"):
+        diarization = journal.get("diarization")
+        diarization_segments = [DiarSegment(**segment) for segment in diarization["segments"]]
+        record.audio_duration_s = diarization["audio_duration_s"]
+        print("Diarization loaded from journal.\n")
+    else:
+        diarization_segments = models.diarize(file_path, record)
+        journal.complete("diarization", {
+            "segments": [asdict(segment) for segment in diarization_segments],
+            "audio_duration_s": record.audio_duration_s,
+        })
+        print("Diarization complete.\n")
 
     print("Step 3/4: Merging transcription with speaker labels...\n")
 
-    formatted_segments = []
-    for segment in transcript:
-        start = segment["start"]
-        end = segment["end"]
-        text = segment["text"]
+    if journal.done("dialog"):
+        formatted_segments = journal.get("dialog")
+    else:
+        with record.stage("merge"):
+            formatted_segments = []
+            for segment in transcript:
+                start = segment["start"]
+                end = segment["end"]
+                text = segment["text"]
 
-        speaker = pick_best_speaker(start, end, diarization_segments)
-        formatted_segments.append({"speaker": speaker, "text": text, "start": start, "end": end})
+                speaker = pick_best_speaker(start, end, diarization_segments)
+                formatted_segments.append({"speaker": speaker, "text": text, "start": start, "end": end})
+        journal.complete("dialog", formatted_segments)
 
     print("\nProcessing finished!")
 
@@ -118,16 +92,24 @@ def analyze_file(
     print("Dialog for analysis:")
     print(f"{full_text}\n")
 
+    if journal.done("analysis"):
+        print("Analysis loaded from journal, retrying database save only.")
+        return save_analysis(agent_host, full_name, record_time, journal.get("analysis"), record, journal, retry)
+
     payload = {
         "dialog": full_text,
         "full_name": full_name,
         "record_time": record_time,
     }
 
-    print(f"Sending request to {agent_api} with timeout=600...")
-    response = requests.post(agent_api, json=payload, timeout=600)
+    analyze_url = f"{agent_host}/analyze"
+    print(f"Sending request to {analyze_url} with timeout=600...")
+    with record.stage("agent") as info:
+        response, info["attempts"] = post_with_retry(analyze_url, payload, retry, timeout=600, idempotent=False)
+        info["http_status"] = response.status_code
     if response.status_code == 200:
         result = response.json()
+        record.agent = result.get("metrics", {})
         status = result.get("status", "unknown")
         analysis = result.get("analysis", "No response")
 
@@ -136,13 +118,18 @@ def analyze_file(
 
         if result.get("db_saved"):
             print("✓ Result saved to database")
-        else:
-            db_error = result.get("db_error", "Unknown error")
-            print(f"✗ Failed to save to database: {db_error}")
-        return True
+            journal.complete("submission", {"status": status, "db_saved": True})
+            return True
+
+        db_error = result.get("db_error", "Unknown error")
+        print(f"✗ Failed to save to database: {db_error}")
+        # Keep the LLM result so the save can be retried without another LLM call
+        journal.complete("analysis", result.get("parsed_data"))
+        return save_analysis(agent_host, full_name, record_time, result.get("parsed_data"), record, journal, retry)
 
     if response.status_code == 400:
         result = response.json()
+        record.agent = result.get("metrics", {})
         error = result.get("error", "Unknown error")
         raw_response = result.get("raw_response", "")
         print(f"Error parsing LLM response: {error}")
@@ -158,3 +145,49 @@ def analyze_file(
         error = response.text
     print(f"Details: {error}")
     return False
+
+
+def save_analysis(
+    agent_host: str,
+    full_name: str,
+    record_time: str,
+    parsed_data: dict,
+    record: FileRecord,
+    journal: FileJournal,
+    retry: RetryPolicy,
+) -> bool:
+    """
+    Retry only the database write for an analysis the LLM already produced.
+    Returns False while the save is still pending, so the run reports it.
+    """
+    save_url = f"{agent_host}/save"
+    payload = {
+        "full_name": full_name,
+        "record_time": record_time,
+        "parsed_data": parsed_data,
+    }
+
+    print(f"Sending request to {save_url}...")
+    with record.stage("db_save") as info:
+        response, info["attempts"] = post_with_retry(save_url, payload, retry, timeout=60)
+        info["http_status"] = response.status_code
+
+    try:
+        result = response.json()
+    except ValueError:
+        result = {"db_error": response.text}
+
+    if response.status_code == 200 and result.get("db_saved"):
+        print("✓ Result saved to database")
+        journal.complete("submission", {"status": result.get("status", "success"), "db_saved": True})
+        return True
+
+    db_error = result.get("db_error", "Unknown error")
+    print(f"✗ Failed to save to database: {db_error}")
+    if response.status_code == 404:
+        print("Add the employee to the database, then rerun with --resume to save this result.")
+    else:
+        print("Rerun with --resume to retry the save without another LLM call.")
+    record.status = "pending_save"
+    record.error = db_error
+    return False
@@ -1,14 +1,18 @@
+from __future__ import annotations
+
 import os
 import subprocess
+import wave
 
 
-def convert_to_mono_wav(input_path: str, output_dir: str, target_sr: int = 16000) -> str:
+def convert_to_mono_wav(input_path: str, output_dir: str, target_sr: int = 16000, name: str | None = None) -> str:
     """Convert any audio file to mono WAV at target_sr using ffmpeg.
     
     NeMo requires mono 16kHz WAV files for diarization.
+    The output is named after the input file unless name is given.
     Returns the path to the converted WAV file.
     """
-    basename = os.path.splitext(os.path.basename(input_path))[0]
+    basename = name or os.path.splitext(os.path.basename(input_path))[0]
     output_path = os.path.join(output_dir, f"{basename}.wav")
 
     cmd = [
@@ -20,4 +24,10 @@ def convert_to_mono_wav(input_path: str, output_dir: str, target_sr: int = 16000
     ]
     subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
 
-    return output_path
\ No newline at end of file
+    return output_path
+
+
+def wav_duration(wav_path: str) -> float:
+    """Return the duration of a PCM WAV file in seconds."""
+    with wave.open(wav_path, "rb") as wav:
+        return wav.getnframes() / float(wav.getframerate())
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import cProfile
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+PROFILERS = ("cprofile", "py-spy")
+
+
+class StageProfiler:
+    """Optional per-stage profiling hook.
+
+    Stages listed in ``stages`` (or every stage when it contains "all") are
+    profiled with cProfile (``.prof`` files, open with snakeviz/pstats) or
+    py-spy (speedscope JSON). Profiles are written to ``out_dir``.
+    """
+
+    def __init__(self, stages: Iterable[str] = (), out_dir: Path | str = "profiles", mode: str = "cprofile"):
+        if mode not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {mode} (expected one of {', '.join(PROFILERS)})")
+        self.stages = {s.strip() for s in stages if s and s.strip()}
+        self.out_dir = Path(out_dir)
+        self.mode = mode
+
+    @classmethod
+    def from_env(cls) -> StageProfiler:
+        """Build from PROFILE_STAGES (comma separated), PROFILER and PROFILE_DIR."""
+        return cls(
+            stages=os.getenv("PROFILE_STAGES", "").split(","),
+            out_dir=os.getenv("PROFILE_DIR", "profiles"),
+            mode=os.getenv("PROFILER", "cprofile"),
+        )
+
+    def enabled_for(self, stage: str) -> bool:
+        return stage in self.stages or "all" in self.stages
+
+    @contextmanager
+    def profile(self, stage: str, label: str = "") -> Iterator[None]:
+        if not self.enabled_for(stage):
+            yield
+            return
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        parts = [stage, re.sub(r"[^\w.-]", "_", label) if label else "", str(int(time.time() * 1000))]
+        stem = "-".join(p for p in parts if p)
+
+        if self.mode == "py-spy":
+            with _py_spy(self.out_dir / f"{stem}.speedscope.json"):
+                yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler is already active in this process (e.g. a concurrent stage)
+            print(f"[profile] Skipping {stage}: {e}")
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out_path = self.out_dir / f"{stem}.prof"
+            profiler.dump_stats(str(out_path))
+            print(f"[profile] {stage} profile written to {out_path}")
+
+
+@contextmanager
+def _py_spy(out_path: Path) -> Iterator[None]:
+    """Sample the current process with py-spy while the block runs."""
+    exe = shutil.which("py-spy")
+    if not exe:
+        print("[profile] py-spy not found in PATH, skipping")
+        yield
+        return
+
+    cmd = [exe, "record", "--pid", str(os.getpid()), "--format", "speedscope", "--output", str(out_path), "--nonblocking"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        yield
+    finally:
+        # py-spy flushes its output on SIGINT
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=30)
+            print(f"[profile] py-spy profile written to {out_path}")
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            print("[profile] py-spy did not stop in time, profile discarded")
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+
+import requests
+
+# Agent replies worth retrying: overloaded (429), Ollama or DB trouble (5xx)
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# 504 means the agent gave up waiting on Ollama, which may still be generating
+NON_IDEMPOTENT_RETRY_STATUSES = RETRY_STATUSES - {504}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 3
+    backoff: float = 5.0
+    max_backoff: float = 120.0
+
+    def __post_init__(self):
+        if self.attempts < 1:
+            raise ValueError("RetryPolicy.attempts must be at least 1")
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """Exponential backoff, or the server's Retry-After hint when it sent one."""
+        if retry_after:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+
+
+def post_with_retry(
+    url: str,
+    payload: dict,
+    policy: RetryPolicy,
+    timeout: float = 600,
+    idempotent: bool = True,
+) -> tuple[requests.Response, int]:
+    """
+    POST JSON, retrying connection errors and RETRY_STATUSES.
+    Read timeouts are only retried for idempotent calls: for an LLM request the
+    server is likely still working, and a retry would queue a second generation.
+    Returns (last response, attempts used); re-raises the last request error.
+    """
+    retry_statuses = RETRY_STATUSES if idempotent else NON_IDEMPOTENT_RETRY_STATUSES
+    # ConnectTimeout is a ConnectionError, so it is retried either way
+    retry_errors: tuple[type[Exception], ...] = (requests.exceptions.ConnectionError,)
+    if idempotent:
+        retry_errors += (requests.exceptions.Timeout,)
+    for attempt in range(1, policy.attempts):
+        try:
+            response = requests.post(url, json=payload, timeout=timeout)
+        except retry_errors as e:
+            delay = policy.delay(attempt)
+            print(f"Request to {url} failed: {e}")
+        else:
+            if response.status_code not in retry_statuses:
+                return response, attempt
+            delay = policy.delay(attempt, response.headers.get("Retry-After"))
+            print(f"Request to {url} returned {response.status_code}")
+
+        print(f"Retrying in {delay:.0f}s (attempt {attempt + 1}/{policy.attempts})...")
+        time.sleep(delay)
+
+    # Last attempt: return whatever comes back, or let the error propagate
+    return requests.post(url, json=payload, timeout=timeout), policy.attempts
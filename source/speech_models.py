@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+
+import requests
+
+from prepare_audio import convert_to_mono_wav, wav_duration
+from telemetry import FileRecord
+from transcription.pick_best_speaker import DiarSegment
+
+
+def whisper_segments(result: dict) -> list[dict]:
+    """Keep only the fields the pipeline uses from a Whisper transcription."""
+    return [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in result["segments"]]
+
+
+class InProcessModels:
+    """Whisper and NeMo models loaded in this process on first use."""
+
+    def __init__(self, whisper_model_name: str, device: str | None = None):
+        self.whisper_model_name = whisper_model_name
+        self.device = device
+        self._whisper_model = None
+        self._diarizer = None
+
+    @property
+    def whisper_model(self):
+        if self._whisper_model is None:
+            import whisper
+
+            print("Loading Whisper model...")
+            self._whisper_model = whisper.load_model(self.whisper_model_name)
+        return self._whisper_model
+
+    @property
+    def diarizer(self):
+        if self._diarizer is None:
+            import torch
+
+            from diarization import NemoDiarizer, load_nemo_diar_base_cfg
+
+            print("Loading NeMo diarization config...")
+            device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            print(f"Using {device.upper()} for NeMo.")
+            diar_base_cfg, diar_yaml_path = load_nemo_diar_base_cfg(device=device, max_num_speakers=3, min_num_speakers=2)
+            self._diarizer = NemoDiarizer(diar_base_cfg, diar_yaml_path)
+        return self._diarizer
+
+    def load(self) -> None:
+        """Load everything up front instead of on the first file."""
+        self.whisper_model
+        self.diarizer
+
+    def transcribe(self, file_path: Path) -> list[dict]:
+        return whisper_segments(self.whisper_model.transcribe(str(file_path)))
+
+    def diarize(self, file_path: Path, record: FileRecord) -> list[DiarSegment]:
+        from diarization import make_work_dir
+
+        diarizer = self.diarizer
+        tmpdir = make_work_dir()
+        try:
+            with record.stage("convert"):
+                wav_path = convert_to_mono_wav(str(file_path), tmpdir)
+            record.audio_duration_s = round(wav_duration(wav_path), 3)
+
+            with record.stage("diarization"):
+                return diarizer.diarize_wavs([wav_path], tmpdir)[0]
+        finally:
+            if tmpdir and Path(tmpdir).exists():
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class ModelServerClient:
+    """
+    Uses a running model_server.py for transcription and diarization.
+    Falls back to in-process models when the server becomes unreachable.
+    """
+
+    def __init__(self, base_url: str, fallback: InProcessModels, timeout: float = 1800):
+        self.base_url = base_url.rstrip("/")
+        self.fallback = fallback
+        self.timeout = timeout
+        self._use_fallback = False
+
+    def available(self) -> bool:
+        try:
+            return requests.get(f"{self.base_url}/health", timeout=2).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def transcribe(self, file_path: Path) -> list[dict]:
+        result = self._call("transcribe", file_path)
+        if result is None:
+            return self.fallback.transcribe(file_path)
+        return result["segments"]
+
+    def diarize(self, file_path: Path, record: FileRecord) -> list[DiarSegment]:
+        # Separate key from the in-process "diarization" stage, so a failed server
+        # call followed by the fallback keeps both timings
+        with record.stage("diarization_server") as info:
+            result = self._call("diarize", file_path)
+            if result is not None:
+                info["server"] = {k: result[k] for k in ("wall_s", "batch_size") if k in result}
+        if result is None:
+            return self.fallback.diarize(file_path, record)
+        record.audio_duration_s = result.get("audio_duration_s")
+        return [DiarSegment(**segment) for segment in result["segments"]]
+
+    def _call(self, endpoint: str, file_path: Path) -> dict | None:
+        """POST a file path (or the file itself if the server can't see it); None means fall back."""
+        if self._use_fallback:
+            return None
+        url = f"{self.base_url}/{endpoint}"
+        try:
+            response = requests.post(url, json={"path": str(Path(file_path).resolve())}, timeout=self.timeout)
+            if response.status_code == 404:
+                with open(file_path, "rb") as f:
+                    response = requests.post(url, files={"audio": (Path(file_path).name, f)}, timeout=self.timeout)
+        except requests.exceptions.ConnectionError:
+            print(f"[models] Model server at {self.base_url} is unreachable, using in-process models")
+            self._use_fallback = True
+            return None
+
+        if response.status_code != 200:
+            try:
+                error = response.json().get("error", response.text)
+            except ValueError:
+                error = response.text
+            raise RuntimeError(f"Model server /{endpoint} error {response.status_code}: {error}")
+        return response.json()
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+from profiling import StageProfiler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process so far, in MiB."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(max_rss / divisor, 1)
+
+
+def current_rss_mb() -> float | None:
+    """Current resident set size of this process in MiB (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's RSS high-water mark (VmHWM) for this process (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def stage_peak_rss_mb() -> float | None:
+    """VmHWM from /proc/self/status in MiB: the peak RSS since the last reset_peak_rss()."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+@dataclass
+class FileRecord:
+    """Structured metrics for one processed audio file, written as a JSON line."""
+    file: str
+    started_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    status: str = "pending"
+    error: str | None = None
+    audio_duration_s: float | None = None
+    stages: dict[str, dict] = field(default_factory=dict)
+    agent: dict = field(default_factory=dict)
+    profiler: StageProfiler | None = field(default=None, repr=False)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        """Time a pipeline stage; extra per-stage fields can be set on the yielded dict."""
+        info: dict = {"rss_before_mb": current_rss_mb()}
+        peak_reset = reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.profile(name, Path(self.file).stem):
+                    yield info
+            else:
+                yield info
+        except BaseException:
+            info["failed"] = True
+            raise
+        finally:
+            info["wall_s"] = round(time.perf_counter() - start, 3)
+            info["rss_after_mb"] = current_rss_mb()
+            # Without a reset VmHWM would be the process-wide peak, not this stage's
+            info["peak_rss_mb"] = stage_peak_rss_mb() if peak_reset else None
+            self.stages[name] = info
+
+    def peak_rss_mb(self) -> float | None:
+        """Highest stage peak; ru_maxrss when per-stage peaks are unavailable."""
+        peaks = [s["peak_rss_mb"] for s in self.stages.values() if s.get("peak_rss_mb") is not None]
+        return max(peaks) if peaks else peak_rss_mb()
+
+    def to_dict(self) -> dict:
+        total = round(sum(s["wall_s"] for s in self.stages.values()), 3)
+        stages = {}
+        for name, info in self.stages.items():
+            stages[name] = dict(info)
+            if self.audio_duration_s:
+                stages[name]["realtime_factor"] = round(info["wall_s"] / self.audio_duration_s, 3)
+        return {
+            "file": self.file,
+            "started_at": self.started_at,
+            "status": self.status,
+            "error": self.error,
+            "audio_duration_s": self.audio_duration_s,
+            "total_wall_s": total,
+            "realtime_factor": round(total / self.audio_duration_s, 3) if self.audio_duration_s else None,
+            "peak_rss_mb": self.peak_rss_mb(),
+            "stages": stages,
+            "agent": self.agent,
+        }
+
+
+def append_record(path: Path, record: FileRecord) -> None:
+    """Append a record to a JSON lines file, creating parent dirs as needed."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record.to_dict(), ensure_ascii=False))
+        f.write("\n")
@@ -0,0 +1,88 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ollama_dispatcher import OllamaDispatcher
+
+
+def start_backend(handle):
+    """Fake Ollama backend; handle(call_number) returns (status, delay_s)"""
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            calls.append(time.monotonic())
+            status, delay = handle(len(calls))
+            time.sleep(delay)
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/generate", calls
+
+
+@pytest.fixture
+def backends():
+    slow, slow_url, slow_calls = start_backend(lambda n: (200, 1.5))
+    # Fails the first request, then answers immediately
+    flaky, flaky_url, flaky_calls = start_backend(lambda n: (500, 0) if n == 1 else (200, 0))
+    yield slow_url, flaky_url, flaky_calls
+    slow.shutdown()
+    flaky.shutdown()
+
+
+def test_failed_over_waiter_does_not_block_idle_backend(backends):
+    slow_url, flaky_url, flaky_calls = backends
+    dispatcher = OllamaDispatcher([slow_url, flaky_url], max_concurrency=1, probe_interval=0, eject_after=10)
+    results = {}
+    t0 = time.monotonic()
+
+    def send(name):
+        response = dispatcher.post({}, timeout=10)
+        results[name] = (response.status_code, time.monotonic() - t0)
+
+    # r2 occupies the slow backend; r1 lands on the flaky one, gets a 500
+    # and fails over to wait for the slow backend
+    r2 = threading.Thread(target=send, args=("r2",))
+    r2.start()
+    time.sleep(0.1)
+    r1 = threading.Thread(target=send, args=("r1",))
+    r1.start()
+    time.sleep(0.3)
+    # r3 arrives while the flaky backend is idle and must not wait behind r1
+    r3 = threading.Thread(target=send, args=("r3",))
+    r3.start()
+    for t in (r1, r2, r3):
+        t.join()
+
+    assert results["r3"][0] == 200
+    assert results["r3"][1] < 1.0
+    assert len(flaky_calls) == 2
+    # r1 keeps its place and is served by the slow backend once r2 is done
+    assert results["r1"][0] == 200
+    assert results["r1"][1] >= 1.5
+
+
+def test_failover_is_not_rejected_by_full_queue(backends):
+    slow_url, flaky_url, _ = backends
+    dispatcher = OllamaDispatcher([slow_url, flaky_url], max_concurrency=1, max_queue=0, probe_interval=0, eject_after=10)
+    results = {}
+
+    def send(name):
+        results[name] = dispatcher.post({}, timeout=10).status_code
+
+    r2 = threading.Thread(target=send, args=("r2",))
+    r2.start()
+    time.sleep(0.1)
+    # With max_queue=0 a regular request would get 429, a failover must still wait
+    send("r1")
+    r2.join()
+    assert results == {"r1": 200, "r2": 200}